@@ -1,18 +1,114 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
 import glob
+import shutil
 import tempfile
 import zipfile
 import io
-import base64
-import re
-import shutil
-import patoolib
-from patoolib import extract_archive
+import hashlib
+import time
+import warnings
+import importlib.metadata
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+# pandas already loads pyarrow; pyarrow.csv and openpyxl are imported on first
+# use so they don't slow down the first page load
+import pyarrow as pa
+
+# Read rosters with calamine when it is installed; otherwise fall back to
+# pandas' default engine (openpyxl/xlrd)
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else None
+
+# openpyxl warns about unsupported extensions (data validation, default styles)
+# on nearly every exported roster; the cell values are unaffected
+warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+# The roster header row is always within the first few rows of the sheet
+HEADER_SCAN_ROWS = 30
+
+def _polars_supported():
+    """Whether polars 1.0+ is installed (its full join with coalesce= is used)"""
+    try:
+        version = importlib.metadata.version("polars")
+    except importlib.metadata.PackageNotFoundError:
+        return False
+    return int(version.split(".")[0]) >= 1
+
+# Use polars for the per-course join when a recent enough version is installed; pandas otherwise
+USE_POLARS = _polars_supported()
+
+# Per-course comparison results kept in the cache; runs walk the courses in the
+# same order, so this must exceed the course count or every lookup misses
+COURSE_CACHE_ENTRIES = 1000
+
+# File extensions picked up by merge_files
+MERGE_EXTENSIONS = {"csv", "xlsx", "xls"}
+
+# Columns of a downloaded grade file used by the comparison
+DOWNLOADED_COLUMNS = {"ID", "Approved final grade", "Withdrawn"}
+
+# Upper bound on courses compared concurrently
+MAX_COURSE_WORKERS = 8
+
+# Above this many result rows, "Auto" packs the comparison ZIP as Parquet
+PARQUET_ROW_THRESHOLD = 100_000
+
+# Fast deflate level for ZIP downloads; CSVs still compress well at level 1
+ZIP_COMPRESSLEVEL = 1
+
+# ZIP entries that are already compressed and are stored as-is
+PRECOMPRESSED_SUFFIXES = (".parquet",)
+
+# Above this many courses, results are shown one at a time through a selectbox instead of tabs
+MAX_COURSE_TABS = 20
 
 st.set_page_config(page_title="Grade Checker App", layout="wide")
 
+def _read_table(file_path):
+    """Read a .csv/.xlsx/.xls file into a DataFrame"""
+    if file_path.lower().endswith(".csv"):
+        return pd.read_csv(file_path)
+    return pd.read_excel(file_path)
+
+def _scan_files(folder_path):
+    """Recursively yield os.DirEntry objects for the files under folder_path"""
+    subdirs = []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file():
+                yield entry
+    # Descend after the current folder's files, like os.walk
+    for subdir in subdirs:
+        yield from _scan_files(subdir)
+
+def fast_to_csv(df, sink):
+    """
+    Write a DataFrame (without its index) to a path or binary buffer using
+    pyarrow's C++ CSV writer. Frames pyarrow cannot convert, e.g. object
+    columns mixing numbers and text, are written with DataFrame.to_csv, as are
+    frames with date/time columns, which pyarrow formats differently.
+    """
+    if any(dtype.kind in "mM" for dtype in df.dtypes):
+        df.to_csv(sink, index=False)
+        return
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except pa.ArrowException:
+        df.to_csv(sink, index=False)
+        return
+    import pyarrow.csv as pacsv
+    pacsv.write_csv(table, sink)
+
+def fast_to_csv_bytes(df):
+    """Serialize a DataFrame to CSV bytes with fast_to_csv"""
+    buf = io.BytesIO()
+    fast_to_csv(df, buf)
+    return buf.getvalue()
+
 def merge_files(folder_path, output_folder):
     """
     1) Creates a temporary folder internally (not passed in).
@@ -34,83 +130,109 @@ def merge_files(folder_path, output_folder):
     # Ensure final output folder exists
     os.makedirs(output_folder, exist_ok=True)
 
-    # 1) Create a temporary directory to hold extracted files
-   
-        # 3) Prepare dictionary: { base_code: [list_of_dataframes] }
+    # { base_code: [list_of_dataframes] }
     course_data = {}
-        
-        # Regex: e.g. "CSAI330_1" => "CSAI330"
-    pattern = re.compile(r"^([A-Za-z0-9]+\d+)(?:_.*)?$", re.IGNORECASE)
-        
-        # Track files processed
-        
-        # Traverse the extracted folder
+    
+    # (path, base_code) for every file to merge, in traversal order
+    file_jobs = []
+    
     # Traverse the given folder
-    for root, _, files in os.walk(folder_path):
-        for filename in files:
-            lower_name = filename.lower()
-            # Only consider .csv/.xlsx/.xls
-            if not (
-                lower_name.endswith(".csv") 
-                or lower_name.endswith(".xlsx") 
-                or lower_name.endswith(".xls")
-            ):
-                continue
-            
-            base_name = os.path.splitext(filename)[0]  # e.g. "MATH101_1"
-            match = pattern.match(base_name)
-            if match:
-                base_code = match.group(1).strip()
-            else:
-                base_code = base_name  # fallback if no match
+    for entry in _scan_files(folder_path):
+        base_name, dot, ext = entry.name.rpartition(".")  # e.g. "MATH101_1", ".", "csv"
+        # Only consider .csv/.xlsx/.xls
+        if not dot or ext.lower() not in MERGE_EXTENSIONS:
+            continue
+        
+        # Base code is the part before the first underscore: "CSAI330_1" => "CSAI330"
+        base_code = base_name.partition("_")[0]
+        # It must be ASCII letters/digits ending in a digit, e.g. "MATH101"
+        if not (len(base_code) > 1 and base_code.isascii() and base_code.isalnum() and base_code[-1].isdigit()):
+            base_code = base_name  # fallback if no match
 
-            file_path = os.path.join(root, filename)
+        file_jobs.append((entry.path, base_code))
 
-            # Read into a DataFrame
-            if lower_name.endswith(".csv"):
-                df = pd.read_csv(file_path)
-            else:
-                df = pd.read_excel(file_path)
-            
-            # Accumulate in dictionary
+    # Read the files into DataFrames concurrently
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        dfs = executor.map(_read_table, [file_path for file_path, _ in file_jobs])
+        
+        # Accumulate in dictionary, keeping the traversal order
+        for (_, base_code), df in zip(file_jobs, dfs):
             course_data.setdefault(base_code, []).append(df)
             
     # Merge each base code's DataFrames and save to 'output_folder'
     for course, df_list in course_data.items():
         if not df_list:
             continue
-
-        # 4) Merge each base code's DataFrames and save to 'output_folder'
-        merged_files = []
-        for course, df_list in course_data.items():
-            if not df_list:
-                continue
-            merged_df = pd.concat(df_list, ignore_index=True)
-            
-            out_name = course + ".csv"
-            out_path = os.path.join(output_folder, out_name)
-            merged_df.to_csv(out_path, index=False)
-            
-            merged_files.append(f"{course}: {len(df_list)} file(s) merged")
+        merged_df = pd.concat(df_list, ignore_index=True, sort=False)
+        
+        out_name = course + ".csv"
+        out_path = os.path.join(output_folder, out_name)
+        fast_to_csv(merged_df, out_path)
     
-    # Temp folder is automatically cleaned up
     return output_folder
 
-def normalize_grade(grade):
-    """Normalize grade format for comparison"""
-    g = str(grade).strip().upper()
-    if g in ["P", "PASS"]:
-        return "PASS"
-    if g in ["ABSENT", "ABS"]:
-        return "ABSENT"
-    return g
+# Grade spellings that are treated as the same grade
+GRADE_ALIASES = {"P": "PASS", "PASS": "PASS", "ABS": "ABSENT", "ABSENT": "ABSENT"}
+
+def normalize_grades(grades):
+    """Normalize a Series of grades for comparison"""
+    g = grades.fillna("NAN").astype(str).str.strip().str.upper()
+    return g.map(GRADE_ALIASES).fillna(g)
+
+def normalize_student_ids(ids):
+    """Convert student IDs to nullable Int64; anything but a whole non-negative number becomes <NA>"""
+    numeric = pd.to_numeric(ids.astype(str).str.strip(), errors="coerce")
+    return numeric.where((numeric >= 0) & (numeric % 1 == 0)).astype("Int64")
 
 
 
-def read_roster_file(file_path, header_keywords=None):
+def _rewind(source):
+    """Seek a file-like object back to its start so one buffer serves every read pass"""
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def _find_header_row(source, header_keywords):
     """
-    Reads an Excel roster file that may contain preliminary information
-    (e.g., title, course info) before the actual header row.
+    Find the index of the roster header row in a path or file-like object.
+
+    Streams the first rows with openpyxl in read-only mode instead of parsing
+    the whole sheet. Legacy .xls files, which openpyxl cannot open, fall back
+    to a pandas read of the same rows.
+    """
+    from openpyxl.reader.excel import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+    
+    id_variants = {"SID", "STUDENT ID"}
+    _rewind(source)
+    wb = None
+    try:
+        # keep_links=False skips loading external-link parts that are never used
+        wb = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+        rows = wb.worksheets[0].iter_rows(max_row=HEADER_SCAN_ROWS, values_only=True)
+    except (zipfile.BadZipFile, InvalidFileException):
+        _rewind(source)
+        df_raw = pd.read_excel(source, header=None, engine=EXCEL_ENGINE, dtype=str, nrows=HEADER_SCAN_ROWS)
+        rows = df_raw.itertuples(index=False, name=None)
+
+    try:
+        for i, row in enumerate(rows):
+            # Convert the row's values to strings, uppercase them, and strip whitespace
+            row_upper = {str(value).upper().strip() for value in row}
+            if header_keywords <= row_upper and (row_upper & id_variants):
+                return i
+    finally:
+        if wb is not None:
+            wb.close()
+    return None
+
+
+def read_roster_file(source, header_keywords=None):
+    """
+    Reads an Excel roster file (a path or file-like object) that may contain
+    preliminary information (e.g., title, course info) before the actual header row.
+    A file-like object is read in place and rewound between passes, so the
+    roster bytes are held in memory only once.
     
     This function scans the top rows for a row that contains the required keywords.
     When found, that row is used as the header.
@@ -121,198 +243,257 @@ def read_roster_file(file_path, header_keywords=None):
         # Make sure the keywords are uppercase for matching.
         header_keywords = {kw.upper() for kw in header_keywords}
     
-    # Read the file without a header to inspect rows.
-    df_raw = pd.read_excel(file_path, header=None)
-    
-    header_row = None
-    id_variants = {"SID", "STUDENT ID"}
-    for i, row in df_raw.iterrows():
-        # Convert the row's values to strings, uppercase them, and strip whitespace
-        row_upper = row.astype(str).str.upper().str.strip()
-        if "LETTER GRADE" in set(row_upper) and (set(row_upper) & id_variants):
-            header_row = i
-            break
+    header_row = _find_header_row(source, header_keywords)
     
     if header_row is None:
-        raise ValueError("Header row with required keywords not found in " + file_path)
+        raise ValueError("Header row with required keywords not found in roster file")
     
-    # Read the file again using the found row as header.
-    df = pd.read_excel(file_path, header=header_row)
+    # Read the file once using the found row as header.
+    _rewind(source)
+    df = pd.read_excel(source, header=header_row, engine=EXCEL_ENGINE)
     return df
 
+
+def read_downloaded_file(data):
     """
-    Compare grades between roster files and downloaded files.
-    Returns results and summary stats.
+    Reads a downloaded grade CSV (raw bytes) with pyarrow, parsing only the
+    columns used by the comparison. Column names are matched after stripping
+    whitespace; files pyarrow cannot parse fall back to pandas.
     """
-    results = []
-    all_unmatched = []
-    summary_stats = {
-        "total_courses": 0,
-        "courses_with_mismatches": 0,
-        "total_mismatches": 0,
-        "total_students": 0,
-        "withdrawn_students": 0
-    }
+    import pyarrow.csv as pacsv
+    
+    try:
+        # Only the header is needed to know which columns are present
+        with pacsv.open_csv(pa.BufferReader(data)) as reader:
+            names = reader.schema.names
+        stripped = [name.strip() for name in names]
+        if len(set(stripped)) < len(stripped):
+            # pyarrow keeps repeated headers as-is; pandas renames them (ID, ID.1)
+            return pd.read_csv(io.BytesIO(data))
+        include = [name for name, key in zip(names, stripped) if key in DOWNLOADED_COLUMNS]
+        table = pacsv.read_csv(
+            pa.BufferReader(data),
+            convert_options=pacsv.ConvertOptions(include_columns=include, strings_can_be_null=True)
+        )
+    except pa.ArrowInvalid:
+        return pd.read_csv(io.BytesIO(data))
+    return table.to_pandas()
+
+
+def _compare_pandas(df_roster_sub, df_downloaded_sub, sid_col):
+    """
+    Outer-join the cleaned roster and downloaded grades on student ID.
+    Returns ID_final, Letter Grade, Approved final grade, matched and is_withdrawn columns.
+    """
+    merged = pd.merge(df_roster_sub, df_downloaded_sub, left_on=sid_col, right_on='ID', how='outer', indicator=True)
+    # Keys are never missing on both sides, so one fill yields every ID
+    merged['ID_final'] = merged[sid_col].fillna(merged['ID'])
+    
+    # Track withdrawals
+    merged['is_withdrawn'] = (merged['Approved final grade'] == 'W') | (merged['Withdrawn'] == 'WITHDRAWN')
+    
+    # Check for grade mismatches
+    # Both grade columns share one set of integer codes, so comparisons are plain int compares
+    grade_codes, grade_values = pd.factorize(pd.concat(
+        [normalize_grades(merged['Letter Grade']), normalize_grades(merged['Approved final grade'])],
+        ignore_index=True
+    ))
+    roster_codes, downloaded_codes = grade_codes[:len(merged)], grade_codes[len(merged):]
+    # -1 when the grade does not occur in this course
+    absent_code, f_code = grade_values.get_indexer(["ABSENT", "F"])
+    mismatch = (merged['_merge'] == 'both').to_numpy() & np.where(
+        roster_codes == absent_code,
+        downloaded_codes != f_code,
+        roster_codes != downloaded_codes
+    )
+    merged['matched'] = ~mismatch
+    return merged[['ID_final', 'Letter Grade', 'Approved final grade', 'matched', 'is_withdrawn']]
+
+
+def _compare_polars(df_roster_sub, df_downloaded_sub, sid_col):
+    """Polars implementation of _compare_pandas, used when polars is installed"""
+    import polars as pl
+    
+    def normalized(col):
+        # Same rules as normalize_grades
+        return pl.col(col).fill_null("NAN").str.strip_chars().str.to_uppercase().replace(GRADE_ALIASES)
+    
+    roster_grade = normalized('Letter Grade')
+    downloaded_grade = normalized('Approved final grade')
+    in_both = pl.col(sid_col).is_not_null() & pl.col('ID').is_not_null()
+    mismatch = in_both & (
+        pl.when(roster_grade == "ABSENT")
+        .then(downloaded_grade != "F")
+        .otherwise(roster_grade != downloaded_grade)
+    )
+    
+    merged = (
+        pl.from_pandas(df_roster_sub).lazy()
+        .join(pl.from_pandas(df_downloaded_sub).lazy(), left_on=sid_col, right_on='ID', how='full', coalesce=False)
+        .with_columns(
+            pl.coalesce(sid_col, 'ID').alias('ID_final'),
+            ~mismatch.alias('matched'),
+            ((pl.col('Approved final grade') == 'W') | (pl.col('Withdrawn') == 'WITHDRAWN')).fill_null(False).alias('is_withdrawn'),
+        )
+        # pandas' outer merge returns rows sorted by key
+        .sort('ID_final', maintain_order=True)
+        .select('ID_final', 'Letter Grade', 'Approved final grade', 'matched', 'is_withdrawn')
+        .collect()
+    )
+    return merged.to_pandas().astype({'ID_final': 'Int64'})
+
+
+def _process_course(roster_file, downloaded_dict):
+    """
+    Compare a single roster file against its matching downloaded file.
+    Returns (result, student_ids); student_ids is None when no matching
+    downloaded file exists and a list of the course's numeric IDs otherwise.
+    """
+    base_name = os.path.splitext(os.path.basename(roster_file.name))[0]
     
-    # Create a dictionary of downloaded files for easy lookup
-    downloaded_dict = {os.path.splitext(os.path.basename(f.name))[0]: f for f in downloaded_files}
+    # Check if we have a matching downloaded file (names compare case-insensitively)
+    downloaded_file = downloaded_dict.get(base_name.upper())
+    if downloaded_file is None:
+        return {
+            "course": base_name,
+            "status": "error",
+            "message": "No matching downloaded file found",
+            "data": None
+        }, None
     
-    for roster_file in roster_files:
-        base_name = os.path.splitext(os.path.basename(roster_file.name))[0]
+    return _process_course_cached(base_name, roster_file.getvalue(), downloaded_file.getvalue())
+
+
+@st.cache_data(show_spinner=False, max_entries=COURSE_CACHE_ENTRIES)
+def _process_course_cached(base_name, roster_bytes, downloaded_bytes):
+    """
+    Compare one course given the raw bytes of its roster and downloaded files.
+    Cached on the file contents so Streamlit reruns skip re-parsing unchanged uploads.
+    """
+    # Process the files
+    try:
+        # Read the uploaded files straight from memory
+        try:
+            df_roster = read_roster_file(io.BytesIO(roster_bytes))
+        except ValueError as e:
+            return {
+                "course": base_name,
+                "status": "error",
+                "message": str(e),
+                "data": None
+            }, []
         
-        # Check if we have a matching downloaded file
-        if base_name in downloaded_dict:
-            summary_stats["total_courses"] += 1
-            downloaded_file = downloaded_dict[base_name]
-            
-            # Process the files
-            try:
-                # Create temporary files to save the uploaded files
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_roster:
-                    tmp_roster.write(roster_file.getvalue())
-                    tmp_roster_path = tmp_roster.name
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_downloaded:
-                    tmp_downloaded.write(downloaded_file.getvalue())
-                    tmp_downloaded_path = tmp_downloaded.name
-                
-                # Read the files
-                try:
-                    df_roster = read_roster_file(tmp_roster_path)
-                except ValueError as e:
-                    results.append({
-                        "course": base_name,
-                        "status": "error",
-                        "message": str(e),
-                        "data": None
-                    })
-                    continue
-                
-                df_downloaded = pd.read_csv(tmp_downloaded_path)
-                
-                # Clean up temporary files
-                os.unlink(tmp_roster_path)
-                os.unlink(tmp_downloaded_path)
-                
-                # Clean column names
-                df_roster.columns = df_roster.columns.str.strip()
-                df_downloaded.columns = df_downloaded.columns.str.strip()
-                
-                # Check for required columns
-                if 'SID' in df_roster.columns:
-                    sid_col = 'SID'
-                elif 'Student ID' in df_roster.columns:
-                    sid_col = 'Student ID'
-                else:
-                    results.append({
-                        "course": base_name,
-                        "status": "error",
-                        "message": "Required student id column is missing.",
-                        "data": None
-                    })
-                    continue
-                
-                if 'Letter Grade' not in df_roster.columns:
-                    results.append({
-                        "course": base_name,
-                        "status": "error",
-                        "message": "'Letter Grade' column is missing.",
-                        "data": None
-                    })
-                    continue
-                
-                if 'ID' not in df_downloaded.columns or 'Approved final grade' not in df_downloaded.columns:
-                    results.append({
-                        "course": base_name,
-                        "status": "error",
-                        "message": "Required columns are missing in downloaded file.",
-                        "data": None
-                    })
-                    continue
-                
-                # Extract relevant columns
-                df_roster_sub = df_roster[[sid_col, 'Letter Grade']].copy()
-                if 'Withdrawn' in df_downloaded.columns:
-                    df_downloaded_sub = df_downloaded[['ID', 'Approved final grade', 'Withdrawn']].copy()
-                else:
-                    df_downloaded_sub = df_downloaded[['ID', 'Approved final grade']].copy()
-                    df_downloaded_sub['Withdrawn'] = ''
-                
-                # Clean data
-                df_roster_sub[sid_col] = df_roster_sub[sid_col].astype(str).str.strip()
-                df_downloaded_sub['ID'] = df_downloaded_sub['ID'].astype(str).str.strip()
-                df_roster_sub['Letter Grade'] = df_roster_sub['Letter Grade'].astype(str).str.strip().str.upper()
-                df_downloaded_sub['Approved final grade'] = df_downloaded_sub['Approved final grade'].astype(str).str.strip().str.upper()
-                df_downloaded_sub['Withdrawn'] = df_downloaded_sub['Withdrawn'].astype(str).str.strip().str.upper()
-                
-                # Merge datasets
-                merged = pd.merge(df_roster_sub, df_downloaded_sub, left_on=sid_col, right_on='ID', how='outer', indicator=True)
-                merged['ID_final'] = merged[sid_col].combine_first(merged['ID']).astype(str).str.strip()
-                merged = merged[merged['ID_final'].notna() & (merged['ID_final'] != '') & (merged['ID_final'].str.lower() != 'nan')]
-                
-                # Track withdrawals
-                merged['is_withdrawn'] = (merged['Approved final grade'] == 'W') | (merged['Withdrawn'] == 'WITHDRAWN')
-                withdrawn_ids = merged.loc[merged['is_withdrawn'], 'ID_final'].tolist()
-                summary_stats["withdrawn_students"] += len(withdrawn_ids)
-                
-                # Check for grade mismatches
-                merged['norm_roster_grade'] = merged['Letter Grade'].apply(normalize_grade)
-                merged['norm_downloaded_grade'] = merged['Approved final grade'].apply(normalize_grade)
-                merged['mismatch'] = (merged['_merge'] == 'both') & (
-                    ((merged['norm_roster_grade'] == "ABSENT") & (merged['norm_downloaded_grade'] != "F")) |
-                    ((merged['norm_roster_grade'] != "ABSENT") & (merged['norm_roster_grade'] != merged['norm_downloaded_grade']))
-                )
-                merged['matched'] = ~merged['mismatch']
-                merged['course'] = base_name
-                
-                # Prepare results
-                result = merged[['course', 'ID_final', 'Letter Grade', 'Approved final grade', 'matched', 'is_withdrawn']]
-                result = result[result['ID_final'].str.isnumeric()]
-                
-                # Update summary statistics
-                summary_stats["total_students"] += len(result)
-                unmatched = result[~result['matched']]
-                unmatched_count = unmatched.shape[0]
-                
-                if unmatched_count > 0:
-                    summary_stats["courses_with_mismatches"] += 1
-                    summary_stats["total_mismatches"] += unmatched_count
-                    all_unmatched.append(unmatched)
-                
-                results.append({
-                    "course": base_name,
-                    "status": "success",
-                    "message": f"Processed {len(result)} students, found {unmatched_count} mismatches, {len(withdrawn_ids)} withdrawn",
-                    "data": result,
-                    "unmatched": unmatched,
-                    "withdrawn": withdrawn_ids
-                })
-                
-            except Exception as e:
-                results.append({
-                    "course": base_name,
-                    "status": "error",
-                    "message": f"Error processing files: {str(e)}",
-                    "data": None
-                })
+        df_downloaded = read_downloaded_file(downloaded_bytes)
+        
+        # Clean column names
+        df_roster.columns = df_roster.columns.str.strip()
+        df_downloaded.columns = df_downloaded.columns.str.strip()
+        roster_cols = set(df_roster.columns)
+        downloaded_cols = set(df_downloaded.columns)
+        
+        # Check for required columns
+        if 'SID' in roster_cols:
+            sid_col = 'SID'
+        elif 'Student ID' in roster_cols:
+            sid_col = 'Student ID'
         else:
-            results.append({
+            return {
                 "course": base_name,
                 "status": "error",
-                "message": "No matching downloaded file found",
+                "message": "Required student id column is missing.",
                 "data": None
-            })
-    
-    return results, summary_stats, all_unmatched
+            }, []
+        
+        if 'Letter Grade' not in roster_cols:
+            return {
+                "course": base_name,
+                "status": "error",
+                "message": "'Letter Grade' column is missing.",
+                "data": None
+            }, []
+        
+        if not {'ID', 'Approved final grade'} <= downloaded_cols:
+            return {
+                "course": base_name,
+                "status": "error",
+                "message": "Required columns are missing in downloaded file.",
+                "data": None
+            }, []
+        
+        # Extract relevant columns
+        df_roster_sub = df_roster[[sid_col, 'Letter Grade']].copy()
+        if 'Withdrawn' in downloaded_cols:
+            df_downloaded_sub = df_downloaded[['ID', 'Approved final grade', 'Withdrawn']].copy()
+        else:
+            df_downloaded_sub = df_downloaded[['ID', 'Approved final grade']].copy()
+            df_downloaded_sub['Withdrawn'] = ''
+        
+        # Clean data; IDs become integers so the merge hashes ints rather than strings
+        df_roster_sub[sid_col] = normalize_student_ids(df_roster_sub[sid_col])
+        df_downloaded_sub['ID'] = normalize_student_ids(df_downloaded_sub['ID'])
+        # Rows without a usable ID are not students (and missing keys would join each other)
+        df_roster_sub = df_roster_sub[df_roster_sub[sid_col].notna()]
+        df_downloaded_sub = df_downloaded_sub[df_downloaded_sub['ID'].notna()]
+        df_roster_sub['Letter Grade'] = df_roster_sub['Letter Grade'].astype(str).str.strip().str.upper()
+        df_downloaded_sub['Approved final grade'] = df_downloaded_sub['Approved final grade'].astype(str).str.strip().str.upper()
+        df_downloaded_sub['Withdrawn'] = df_downloaded_sub['Withdrawn'].astype(str).str.strip().str.upper()
+        
+        # Merge datasets and flag withdrawals and grade mismatches
+        compare = _compare_polars if USE_POLARS else _compare_pandas
+        merged = compare(df_roster_sub, df_downloaded_sub, sid_col)
+        merged['course'] = base_name
+        
+        # Prepare results
+        result = merged[['course', 'ID_final', 'Letter Grade', 'Approved final grade', 'matched', 'is_withdrawn']]
+        # Narrow dtypes once here so the CSVs, the ZIP and st.dataframe all see the smaller schema
+        result = result.astype({
+            'course': 'category',
+            'Letter Grade': 'category',
+            'Approved final grade': 'category',
+        })
+        result['ID_final'] = pd.to_numeric(result['ID_final'], downcast='integer')
+        withdrawn_ids = result.loc[result['is_withdrawn'], 'ID_final'].astype(str).tolist()
+        
+        # Collect this course's student IDs for unique student tracking
+        valid_ids = result['ID_final'].tolist()
+        
+        unmatched = result[~result['matched']]
+        unmatched_count = unmatched.shape[0]
+        withdrawn_count = len(withdrawn_ids)
+        
+        return {
+            "course": base_name,
+            "status": "success",
+            "message": f"Processed {len(result)} students, found {unmatched_count} mismatches, {withdrawn_count} withdrawn",
+            "data": result,
+            "unmatched": unmatched,
+            # Column subset shown in the course tab, sliced once here rather than on every render
+            "unmatched_view": unmatched[['ID_final', 'Letter Grade', 'Approved final grade']],
+            "withdrawn": withdrawn_ids,
+            # Counts and headings for the course tab, so rendering is pure lookups
+            "n_unmatched": unmatched_count,
+            "n_withdrawn": withdrawn_count,
+            "unmatched_label": f"Grade Mismatches ({unmatched_count})",
+            "withdrawn_label": f"Withdrawn Students ({withdrawn_count})",
+            "withdrawn_text": ", ".join(withdrawn_ids)
+        }, valid_ids
+        
+    except Exception as e:
+        return {
+            "course": base_name,
+            "status": "error",
+            "message": f"Error processing files: {str(e)}",
+            "data": None
+        }, []
 
 
 def compare_grades(roster_files, downloaded_files):
     """
     Compare grades between roster files and downloaded files.
+    Courses are processed concurrently; stats are aggregated afterwards.
     Returns results and summary stats.
     """
     results = []
-    all_unmatched = []
     # Track unique student IDs across all courses
     unique_student_ids = set()
     
@@ -325,202 +506,198 @@ def compare_grades(roster_files, downloaded_files):
         "withdrawn_students": 0
     }
     
-    # Create a dictionary of downloaded files for easy lookup
-    downloaded_dict = {os.path.splitext(os.path.basename(f.name))[0]: f for f in downloaded_files}
+    # Create a dictionary of downloaded files for easy lookup, keyed by upper-cased course name
+    downloaded_dict = {os.path.splitext(os.path.basename(f.name))[0].upper(): f for f in downloaded_files}
     
-    for roster_file in roster_files:
-        base_name = os.path.splitext(os.path.basename(roster_file.name))[0]
+    # Each course is independent; pandas and file I/O release the GIL
+    max_workers = max(1, min(MAX_COURSE_WORKERS, len(roster_files)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        course_outputs = list(executor.map(lambda f: _process_course(f, downloaded_dict), roster_files))
+    
+    # Aggregate in the main thread so no locking is needed
+    for result, student_ids in course_outputs:
+        results.append(result)
+        if student_ids is None:
+            continue
         
-        # Check if we have a matching downloaded file
-        if base_name in downloaded_dict:
-            summary_stats["total_courses"] += 1
-            downloaded_file = downloaded_dict[base_name]
-            
-            # Process the files
-            try:
-                # Create temporary files to save the uploaded files
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_roster:
-                    tmp_roster.write(roster_file.getvalue())
-                    tmp_roster_path = tmp_roster.name
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_downloaded:
-                    tmp_downloaded.write(downloaded_file.getvalue())
-                    tmp_downloaded_path = tmp_downloaded.name
-                
-                # Read the files
-                try:
-                    df_roster = read_roster_file(tmp_roster_path)
-                except ValueError as e:
-                    results.append({
-                        "course": base_name,
-                        "status": "error",
-                        "message": str(e),
-                        "data": None
-                    })
-                    continue
-                
-                df_downloaded = pd.read_csv(tmp_downloaded_path)
-                
-                # Clean up temporary files
-                os.unlink(tmp_roster_path)
-                os.unlink(tmp_downloaded_path)
-                
-                # Clean column names
-                df_roster.columns = df_roster.columns.str.strip()
-                df_downloaded.columns = df_downloaded.columns.str.strip()
-                
-                # Check for required columns
-                if 'SID' in df_roster.columns:
-                    sid_col = 'SID'
-                elif 'Student ID' in df_roster.columns:
-                    sid_col = 'Student ID'
-                else:
-                    results.append({
-                        "course": base_name,
-                        "status": "error",
-                        "message": "Required student id column is missing.",
-                        "data": None
-                    })
-                    continue
-                
-                if 'Letter Grade' not in df_roster.columns:
-                    results.append({
-                        "course": base_name,
-                        "status": "error",
-                        "message": "'Letter Grade' column is missing.",
-                        "data": None
-                    })
-                    continue
-                
-                if 'ID' not in df_downloaded.columns or 'Approved final grade' not in df_downloaded.columns:
-                    results.append({
-                        "course": base_name,
-                        "status": "error",
-                        "message": "Required columns are missing in downloaded file.",
-                        "data": None
-                    })
-                    continue
-                
-                # Extract relevant columns
-                df_roster_sub = df_roster[[sid_col, 'Letter Grade']].copy()
-                if 'Withdrawn' in df_downloaded.columns:
-                    df_downloaded_sub = df_downloaded[['ID', 'Approved final grade', 'Withdrawn']].copy()
-                else:
-                    df_downloaded_sub = df_downloaded[['ID', 'Approved final grade']].copy()
-                    df_downloaded_sub['Withdrawn'] = ''
-                
-                # Clean data
-                df_roster_sub[sid_col] = df_roster_sub[sid_col].astype(str).str.strip()
-                df_downloaded_sub['ID'] = df_downloaded_sub['ID'].astype(str).str.strip()
-                df_roster_sub['Letter Grade'] = df_roster_sub['Letter Grade'].astype(str).str.strip().str.upper()
-                df_downloaded_sub['Approved final grade'] = df_downloaded_sub['Approved final grade'].astype(str).str.strip().str.upper()
-                df_downloaded_sub['Withdrawn'] = df_downloaded_sub['Withdrawn'].astype(str).str.strip().str.upper()
-                
-                # Merge datasets
-                merged = pd.merge(df_roster_sub, df_downloaded_sub, left_on=sid_col, right_on='ID', how='outer', indicator=True)
-                merged['ID_final'] = merged[sid_col].combine_first(merged['ID']).astype(str).str.strip()
-                merged = merged[merged['ID_final'].notna() & (merged['ID_final'] != '') & (merged['ID_final'].str.lower() != 'nan')]
-                
-                # Track withdrawals
-                merged['is_withdrawn'] = (merged['Approved final grade'] == 'W') | (merged['Withdrawn'] == 'WITHDRAWN')
-                withdrawn_ids = merged.loc[merged['is_withdrawn'], 'ID_final'].tolist()
-                summary_stats["withdrawn_students"] += len(withdrawn_ids)
-                
-                # Add this course's student IDs to our unique student tracking set
-                valid_ids = merged['ID_final'][merged['ID_final'].str.isnumeric()]
-                unique_student_ids.update(valid_ids)
-                
-                # Check for grade mismatches
-                merged['norm_roster_grade'] = merged['Letter Grade'].apply(normalize_grade)
-                merged['norm_downloaded_grade'] = merged['Approved final grade'].apply(normalize_grade)
-                merged['mismatch'] = (merged['_merge'] == 'both') & (
-                    ((merged['norm_roster_grade'] == "ABSENT") & (merged['norm_downloaded_grade'] != "F")) |
-                    ((merged['norm_roster_grade'] != "ABSENT") & (merged['norm_roster_grade'] != merged['norm_downloaded_grade']))
-                )
-                merged['matched'] = ~merged['mismatch']
-                merged['course'] = base_name
-                
-                # Prepare results
-                result = merged[['course', 'ID_final', 'Letter Grade', 'Approved final grade', 'matched', 'is_withdrawn']]
-                result = result[result['ID_final'].str.isnumeric()]
-                
-                # Update total students (not unique) - keep this for per-course counting
-                summary_stats["total_students"] += len(result)
-                
-                unmatched = result[~result['matched']]
-                unmatched_count = unmatched.shape[0]
-                
-                if unmatched_count > 0:
-                    summary_stats["courses_with_mismatches"] += 1
-                    summary_stats["total_mismatches"] += unmatched_count
-                    all_unmatched.append(unmatched)
-                
-                results.append({
-                    "course": base_name,
-                    "status": "success",
-                    "message": f"Processed {len(result)} students, found {unmatched_count} mismatches, {len(withdrawn_ids)} withdrawn",
-                    "data": result,
-                    "unmatched": unmatched,
-                    "withdrawn": withdrawn_ids
-                })
-                
-            except Exception as e:
-                results.append({
-                    "course": base_name,
-                    "status": "error",
-                    "message": f"Error processing files: {str(e)}",
-                    "data": None
-                })
-        else:
-            results.append({
-                "course": base_name,
-                "status": "error",
-                "message": "No matching downloaded file found",
-                "data": None
-            })
+        summary_stats["total_courses"] += 1
+        unique_student_ids.update(student_ids)
+        if result["status"] != "success":
+            continue
+        
+        summary_stats["withdrawn_students"] += result["n_withdrawn"]
+        # Update total students (not unique) - keep this for per-course counting
+        summary_stats["total_students"] += len(result["data"])
+        
+        unmatched_count = result["n_unmatched"]
+        if unmatched_count > 0:
+            summary_stats["courses_with_mismatches"] += 1
+            summary_stats["total_mismatches"] += unmatched_count
     
     # Set the unique students count
     summary_stats["unique_students"] = len(unique_student_ids)
     
-    return results, summary_stats, all_unmatched
-
-def create_download_link(df, filename):
-    """
-    Create a download link for a dataframe
-    """
-    csv = df.to_csv(index=False)
-    b64 = base64.b64encode(csv.encode()).decode()
-    href = f'<a href="data:file/csv;base64,{b64}" download="{filename}">Download {filename}</a>'
-    return href
+    return results, summary_stats
 
 def get_all_results_df(results):
     """
     Combine all results into a single dataframe
     """
-    dfs = []
-    for result in results:
-        if result["status"] == "success" and result["data"] is not None:
-            dfs.append(result["data"])
+    dfs = [r["data"] for r in results if r["status"] == "success" and r["data"] is not None]
     
     if dfs:
-        return pd.concat(dfs, ignore_index=True)
+        return pd.concat(dfs, ignore_index=True, sort=False)
+    return None
+
+def get_all_unmatched_df(all_results_df):
+    """
+    Select all courses' mismatches from the combined results.
+    Masking the already-combined frame avoids concatenating the mismatches again.
+    """
+    if all_results_df is None:
+        return None
+    unmatched = all_results_df[~all_results_df['matched']].reset_index(drop=True)
+    if len(unmatched):
+        return unmatched
     return None
 
-def create_zip_file(directory):
+def uploads_key(*file_groups):
+    """Content hash of groups of uploaded files, used to tell when stored results are stale"""
+    digest = hashlib.md5()
+    for files in file_groups:
+        for f in files:
+            digest.update(f.name.encode())
+            digest.update(hashlib.md5(f.getvalue()).digest())
+    return digest.hexdigest()
+
+def create_zip_file(directory, compresslevel=ZIP_COMPRESSLEVEL):
     """Create a zipfile from a directory"""
     memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    # Archive names are relative to the directory's parent, so it appears as the top folder
+    parent = os.path.dirname(os.path.abspath(directory))
+    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zipf:
         for root, dirs, files in os.walk(directory):
             for file in files:
-                zipf.write(os.path.join(root, file), 
-                           os.path.relpath(os.path.join(root, file), 
-                                         os.path.join(directory, '..')))
+                file_path = os.path.join(root, file)
+                zipf.write(file_path, os.path.relpath(file_path, parent))
     memory_file.seek(0)
     return memory_file
 
+def create_zip_from_entries(entries, compresslevel=ZIP_COMPRESSLEVEL):
+    """
+    Create a zipfile in memory from (file name, data) entries, without touching disk.
+    data is either bytes or a callable that writes the file to a binary stream; callables
+    write straight into the compressor, so the uncompressed file is never held whole.
+    """
+    memory_file = io.BytesIO()
+    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zipf:
+        for name, data in entries:
+            target = name
+            if name.endswith(PRECOMPRESSED_SUFFIXES):
+                # Deflating already-compressed data costs CPU and saves nothing
+                target = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                target.compress_type = zipfile.ZIP_STORED
+            if callable(data):
+                with zipf.open(target, 'w', force_zip64=True) as fp:
+                    data(fp)
+            else:
+                zipf.writestr(target, data)
+    memory_file.seek(0)
+    return memory_file
+
+def comparison_stems(results):
+    """
+    File stem of each result's comparison file (None for results without data).
+    Rosters may share a name, so repeated stems are numbered: MATH101_comparison_2.
+    """
+    stems = []
+    counts = {}
+    for result in results:
+        if result["status"] != "success" or result["data"] is None:
+            stems.append(None)
+            continue
+        stem = f"{result['course']}_comparison"
+        counts[stem] = counts.get(stem, 0) + 1
+        stems.append(stem if counts[stem] == 1 else f"{stem}_{counts[stem]}")
+    return stems
+
+def iter_comparison_frames(results, all_results_df, all_unmatched_df):
+    """Yield (file stem, dataframe) for every comparison output file"""
+    if all_results_df is not None:
+        yield "all_results", all_results_df
+    if all_unmatched_df is not None:
+        yield "all_mismatches", all_unmatched_df
+    for result, stem in zip(results, comparison_stems(results)):
+        if stem is not None:
+            yield stem, result["data"]
+
+def iter_comparison_csvs(results, all_results_df, all_unmatched_df):
+    """
+    Yield (file name, CSV bytes) for every comparison output file. The files are
+    serialized in parallel; pyarrow's CSV writer releases the GIL while it encodes.
+    """
+    frames = list(iter_comparison_frames(results, all_results_df, all_unmatched_df))
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        csvs = executor.map(fast_to_csv_bytes, [df for _, df in frames])
+        for (stem, _), data in zip(frames, csvs):
+            yield f"{stem}.csv", data
+
+def iter_comparison_parquets(results, all_results_df, all_unmatched_df):
+    """Yield (file name, writer) pairs that write each comparison output as zstd Parquet"""
+    for stem, df in iter_comparison_frames(results, all_results_df, all_unmatched_df):
+        yield f"{stem}.parquet", lambda fp, df=df: df.to_parquet(fp, compression="zstd", index=False)
+
+def _show_course_result(index, result, stem, csv_cache):
+    """Render the comparison result at position index, whose file stem comes from comparison_stems"""
+    if result["status"] == "success":
+        st.success(result["message"])
+        
+        # Display withdrawn students if any
+        if result["n_withdrawn"]:
+            with st.expander(result["withdrawn_label"]):
+                st.write(result["withdrawn_text"])
+        
+        # Display mismatches if any
+        if result["n_unmatched"] > 0:
+            st.subheader(result["unmatched_label"])
+            st.dataframe(result["unmatched_view"], use_container_width=True)
+        else:
+            st.success("No grade mismatches found!")
+        
+        # Display all data
+        with st.expander("View All Data"):
+            st.dataframe(result["data"], use_container_width=True)
+        
+        # Download link for this course
+        # (course names can repeat, so the widget key uses the result's position)
+        course_csv = f"{stem}.csv"
+        st.download_button(
+            label=f"Download {course_csv}",
+            data=csv_cache[course_csv],
+            file_name=course_csv,
+            mime="text/csv",
+            key=f"download_course_{index}"
+        )
+    else:
+        st.error(result["message"])
+
 # Main Streamlit app
 st.title("Grade Checker App")
 
+zip_compresslevel = st.sidebar.slider(
+    "ZIP compression level",
+    min_value=0,
+    max_value=9,
+    value=ZIP_COMPRESSLEVEL,
+    help="Higher levels make smaller ZIP downloads but take longer to build."
+)
+
+zip_format = st.sidebar.radio(
+    "Comparison ZIP format",
+    ["Auto", "CSV", "Parquet"],
+    help=f"Auto uses Parquet when the comparison has more than {PARQUET_ROW_THRESHOLD:,} rows."
+)
+
 # Create a tabbed interface
 tab1, tab2 = st.tabs(["Extract & Merge", "Compare Grades"])
 
@@ -549,27 +726,30 @@ with tab1:
         file_names = [file.name for file in uploaded_files]
         st.write("Uploaded files:", ", ".join(file_names))
         
-        # Create temporary directory for processing
-        temp_input_dir = tempfile.mkdtemp()
-        temp_output_dir = tempfile.mkdtemp()
-        
-        # Save uploaded files to temporary directory
-        for uploaded_file in uploaded_files:
-            file_path = os.path.join(temp_input_dir, uploaded_file.name)
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getvalue())
-        
         # Add a button to merge files
         if st.button("Merge Files", type="primary"):
+            # The merged folder outlives this run (the Compare Grades tab reads it)
+            temp_output_dir = tempfile.mkdtemp()
             with st.spinner("Merging files..."):
                 try:
-                    # Call the merge function
-                    output_folder = merge_files(temp_input_dir, temp_output_dir)
+                    # Uploads only need to be on disk while merging
+                    with tempfile.TemporaryDirectory() as temp_input_dir:
+                        for uploaded_file in uploaded_files:
+                            file_path = os.path.join(temp_input_dir, uploaded_file.name)
+                            with open(file_path, "wb") as f:
+                                f.write(uploaded_file.getvalue())
+                        
+                        # Call the merge function
+                        output_folder = merge_files(temp_input_dir, temp_output_dir)
                     
                     # Get merged files
                     merged_files = [f for f in glob.glob(os.path.join(output_folder, "*.csv"))]
                     
                     if merged_files:
+                        # Replace the previous merge's folder, and any selection made from it
+                        if "merged_folder" in st.session_state:
+                            shutil.rmtree(st.session_state.merged_folder, ignore_errors=True)
+                            st.session_state.pop("downloaded_files_paths", None)
                         st.session_state.merged_folder = output_folder
                         st.session_state.has_merged_files = True
                         
@@ -593,7 +773,7 @@ with tab1:
                             )
                         
                         # Create a ZIP file with all merged files
-                        results_zip = create_zip_file(output_folder)
+                        results_zip = create_zip_file(output_folder, zip_compresslevel)
                         st.download_button(
                             label="Download All Merged Files (ZIP)",
                             data=results_zip,
@@ -606,8 +786,10 @@ with tab1:
                         if st.button("Go to Compare Grades Tab"):
                             st.session_state.active_tab = "Compare Grades"
                     else:
+                        shutil.rmtree(temp_output_dir, ignore_errors=True)
                         st.warning("No files were merged. Please check your input files.")
                 except Exception as e:
+                    shutil.rmtree(temp_output_dir, ignore_errors=True)
                     st.error(f"Error merging files: {str(e)}")
     else:
         st.info("Upload files to begin merging process.")
@@ -685,9 +867,46 @@ with tab2:
     # Process files when button is clicked
     compare_ready = roster_files and (downloaded_files if 'downloaded_files' in locals() else False)
     
+    # Stored results belong to one set of uploads; drop them once the uploads change
+    inputs_key = uploads_key(roster_files, downloaded_files) if compare_ready else None
+    if st.session_state.get("inputs_key") != inputs_key:
+        for key in ("results", "summary_stats", "agg", "csv_cache", "zip_bytes", "zip_settings"):
+            st.session_state.pop(key, None)
+    
     if st.button("Compare Grades", type="primary", disabled=not compare_ready):
         with st.spinner("Processing files..."):
-            results, summary_stats, all_unmatched = compare_grades(roster_files, downloaded_files)
+            results, summary_stats = compare_grades(roster_files, downloaded_files)
+        
+        # Combine results once; the display, download buttons and ZIP all reuse them
+        all_results_df = get_all_results_df(results)
+        all_unmatched_df = get_all_unmatched_df(all_results_df)
+        
+        # Keep the comparison in the session so reruns (e.g. download clicks) don't redo it
+        st.session_state["inputs_key"] = inputs_key
+        st.session_state["results"] = results
+        st.session_state["summary_stats"] = summary_stats
+        st.session_state["agg"] = {
+            "all_results": all_results_df,
+            "all_unmatched": all_unmatched_df,
+            # Display copy, built once and Arrow-backed so st.dataframe needn't convert it
+            "all_unmatched_view": (
+                all_unmatched_df[['course', 'ID_final', 'Letter Grade', 'Approved final grade']]
+                .convert_dtypes(dtype_backend="pyarrow")
+                if all_unmatched_df is not None else None
+            ),
+        }
+        # Serialize every output file once; download buttons and the ZIP share the bytes
+        st.session_state["csv_cache"] = dict(iter_comparison_csvs(results, all_results_df, all_unmatched_df))
+        st.session_state.pop("zip_bytes", None)
+        st.session_state.pop("zip_settings", None)
+    
+    if "results" in st.session_state:
+        results = st.session_state["results"]
+        summary_stats = st.session_state["summary_stats"]
+        all_results_df = st.session_state["agg"]["all_results"]
+        all_unmatched_df = st.session_state["agg"]["all_unmatched"]
+        all_unmatched_view = st.session_state["agg"]["all_unmatched_view"]
+        csv_cache = st.session_state["csv_cache"]
         
         # Display summary
         st.header("Summary")
@@ -701,87 +920,76 @@ with tab2:
         with col3:
             st.metric("Withdrawn Students", summary_stats["withdrawn_students"])
         
-        # Create output directory for comparison results
-        output_dir = tempfile.mkdtemp()
-        
-        # Save all results
-        all_results_df = get_all_results_df(results)
-        if all_results_df is not None:
-            all_results_path = os.path.join(output_dir, "all_results.csv")
-            all_results_df.to_csv(all_results_path, index=False)
-        
-        # Save all mismatches
-        if all_unmatched:
-            all_unmatched_df = pd.concat(all_unmatched, ignore_index=True)
-            all_unmatched_path = os.path.join(output_dir, "all_mismatches.csv")
-            all_unmatched_df.to_csv(all_unmatched_path, index=False)
-        
-        # Save individual course results
-        for result in results:
-            if result["status"] == "success" and result["data"] is not None:
-                course_path = os.path.join(output_dir, f"{result['course']}_comparison.csv")
-                result["data"].to_csv(course_path, index=False)
-        
         # Display detailed results
         st.header("Course Results")
+        stems = comparison_stems(results)
         
-        # Create tabs for each course result
-        tabs = st.tabs([result["course"] for result in results])
-        
-        for i, tab in enumerate(tabs):
-            result = results[i]
-            with tab:
-                if result["status"] == "success":
-                    st.success(result["message"])
-                    
-                    # Display withdrawn students if any
-                    if result["withdrawn"]:
-                        with st.expander(f"Withdrawn Students ({len(result['withdrawn'])})"):
-                            st.write(", ".join(result["withdrawn"]))
-                    
-                    # Display mismatches if any
-                    if len(result["unmatched"]) > 0:
-                        st.subheader(f"Grade Mismatches ({len(result['unmatched'])})")
-                        st.dataframe(
-                            result["unmatched"][['ID_final', 'Letter Grade', 'Approved final grade']],
-                            use_container_width=True
-                        )
-                    else:
-                        st.success("No grade mismatches found!")
-                    
-                    # Display all data
-                    with st.expander("View All Data"):
-                        st.dataframe(result["data"], use_container_width=True)
-                    
-                    # Download link for this course
-                    st.markdown(create_download_link(result["data"], f"{result['course']}_comparison.csv"), unsafe_allow_html=True)
-                else:
-                    st.error(result["message"])
+        if len(results) > MAX_COURSE_TABS:
+            # Tabs render every course on each rerun; with many courses show one at a time
+            selected = st.selectbox(
+                "Course",
+                range(len(results)),
+                format_func=lambda i: results[i]["course"]
+            )
+            _show_course_result(selected, results[selected], stems[selected], csv_cache)
+        else:
+            # Create tabs for each course result
+            tabs = st.tabs([result["course"] for result in results])
+            
+            for i, tab in enumerate(tabs):
+                with tab:
+                    _show_course_result(i, results[i], stems[i], csv_cache)
         
         # All mismatches section
-        if all_unmatched:
+        if all_unmatched_df is not None:
             st.header("All Mismatches")
-            all_unmatched_df = pd.concat(all_unmatched, ignore_index=True)
-            st.dataframe(all_unmatched_df[['course', 'ID_final', 'Letter Grade', 'Approved final grade']], use_container_width=True)
+            st.dataframe(all_unmatched_view, use_container_width=True)
             
-            # Download link for all mismatches
-            st.markdown(create_download_link(all_unmatched_df, "all_mismatches.csv"), unsafe_allow_html=True)
+            # Download button for all mismatches
+            st.download_button(
+                label="Download all_mismatches.csv",
+                data=csv_cache["all_mismatches.csv"],
+                file_name="all_mismatches.csv",
+                mime="text/csv",
+                key="download_all_mismatches.csv"
+            )
         
         # Download all results
         if all_results_df is not None:
             st.header("Download Results")
             
-            # Download link for all results
-            st.markdown(create_download_link(all_results_df, "all_results.csv"), unsafe_allow_html=True)
-            
-            # Create a download button for all files
-            results_zip = create_zip_file(output_dir)
+            # Download button for all results
             st.download_button(
-                label="Download All Comparison Files (ZIP)",
-                data=results_zip,
-                file_name="comparison_results.zip",
-                mime="application/zip"
+                label="Download all_results.csv",
+                data=csv_cache["all_results.csv"],
+                file_name="all_results.csv",
+                mime="text/csv",
+                key="download_all_results.csv"
             )
+            
+            # Offer all files as one ZIP, in CSV or Parquet. Building it is deferred until
+            # asked for, and the result is kept until the sidebar settings change
+            zip_settings = (zip_format, zip_compresslevel)
+            if st.session_state.get("zip_settings") != zip_settings:
+                if st.button("Prepare All Comparison Files (ZIP)"):
+                    use_parquet = zip_format == "Parquet" or (
+                        zip_format == "Auto" and len(all_results_df) > PARQUET_ROW_THRESHOLD
+                    )
+                    if use_parquet:
+                        zip_entries = iter_comparison_parquets(results, all_results_df, all_unmatched_df)
+                    else:
+                        # Reuse the CSVs already built for the download buttons
+                        zip_entries = csv_cache.items()
+                    with st.spinner("Building ZIP..."):
+                        st.session_state["zip_bytes"] = create_zip_from_entries(zip_entries, zip_compresslevel).getvalue()
+                    st.session_state["zip_settings"] = zip_settings
+            if st.session_state.get("zip_settings") == zip_settings:
+                st.download_button(
+                    label="Download All Comparison Files (ZIP)",
+                    data=st.session_state["zip_bytes"],
+                    file_name="comparison_results.zip",
+                    mime="application/zip"
+                )
 
 # Footer
 st.divider()